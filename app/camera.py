@@ -1,10 +1,17 @@
+import atexit
+import io
 import os
 import time
 import platform
-from datetime import datetime
-from typing import Optional
+import threading
+from functools import cache
+from typing import Optional, Union
 from flask import current_app
-from PIL import Image, ImageDraw
+from .jpeg import MJPEG_PART_HEADER, encode_jpeg, get_turbojpeg
+
+# Detect once at import whether we are on a Raspberry Pi (32-bit or 64-bit ARM Linux)
+_IS_RPI = platform.system() == "Linux" and platform.machine() in ("armv6l", "armv7l", "aarch64", "arm64")
+
 
 class CameraService:
     def __init__(self, source: Optional[str] = None) -> None:
@@ -17,17 +24,27 @@ class CameraService:
         self._picam2 = None
         self._cv2 = None
         self._cap = None
+        self._latest_frame = None
+        self._frame_lock = threading.Lock()
+        self._frame_ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._reader: Optional[threading.Thread] = None
+        self._last_sec = -1
+        self._last_ts_str = ""
+        self._last_capture_sec = -1
+        self._capture_seq = 0
+        self._mock_base = None
+        self._mock_ts = None
+        self._mock_jpeg: Optional[Union[bytes, memoryview]] = None
         self.source = source or "auto"
 
-        # Detect if we are on Raspberry Pi
-        is_raspberry_pi = platform.machine().startswith("arm") and platform.system() == "Linux"
-
         # Try PiCamera2 on Raspberry Pi
-        if self.source in ("auto", "picamera2") and is_raspberry_pi:
+        if self.source in ("auto", "picamera2") and _IS_RPI:
             try:
                 from picamera2 import Picamera2  # type: ignore
                 self._picam2 = Picamera2()
-                self._picam2.configure(self._picam2.create_still_configuration())
+                # RGB888 gives BGR-ordered arrays, matching OpenCV for capture_array()
+                self._picam2.configure(self._picam2.create_still_configuration(main={"format": "RGB888"}))
                 self._picam2.start()
                 time.sleep(0.5)
                 self.source = "picamera2"
@@ -46,6 +63,9 @@ class CameraService:
                 self._cap = cv2.VideoCapture(0)
                 if self._cap is not None and self._cap.isOpened():
                     self.source = "opencv"
+                    self._reader = threading.Thread(target=self._reader_loop, daemon=True)
+                    self._reader.start()
+                    atexit.register(self.close)
                     print("[CameraService] Using OpenCV webcam")
                     return
                 else:
@@ -57,8 +77,79 @@ class CameraService:
 
         # Fallback to Mock
         self.source = "mock"
+        from PIL import Image
+        self._mock_base = Image.new("RGB", (640, 480), color=(60, 120, 60))
         print("[CameraService] Using mock camera")
 
+    def _format_ts(self, now: int) -> str:
+        """Format a wall-clock second as YYYYmmdd_HHMMSS, re-formatting only when the second changes."""
+        if now != self._last_sec:
+            self._last_ts_str = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+            self._last_sec = now
+        return self._last_ts_str
+
+    def _reader_loop(self) -> None:
+        """
+        Producer thread: keep pulling frames from the OpenCV capture so that
+        consumers never block on the driver and only pick up the latest frame.
+        """
+        while not self._stop_event.is_set():
+            try:
+                ret, frame = self._cap.read()
+            except Exception as exc:
+                print(f"[CameraService] OpenCV capture exception: {exc}")
+                ret, frame = False, None
+            if not ret:
+                time.sleep(0.05)
+                continue
+            # cap.read() returns a fresh array each time, so publishing the reference is safe
+            with self._frame_lock:
+                self._latest_frame = frame
+            self._frame_ready.set()
+
+    def _read_frame(self, timeout: float = 1.0):
+        """Return the most recent OpenCV frame, waiting briefly for the first one."""
+        if not self._frame_ready.wait(timeout):
+            return None
+        with self._frame_lock:
+            return self._latest_frame
+
+    def close(self) -> None:
+        """Stop the OpenCV reader thread and release the camera."""
+        self._stop_event.set()
+        if self._reader is not None:
+            self._reader.join(timeout=1.0)
+            self._reader = None
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _render_mock(self, ts: str) -> bytes:
+        """
+        Render the mock frame as JPEG bytes.
+        The encoded frame only changes with the timestamp, so it is reused within the same second.
+        """
+        if self._mock_jpeg is not None and ts == self._mock_ts:
+            return self._mock_jpeg
+
+        from PIL import Image, ImageDraw
+
+        if self._mock_base is None:
+            self._mock_base = Image.new("RGB", (640, 480), color=(60, 120, 60))
+        img = self._mock_base.copy()
+        draw = ImageDraw.Draw(img)
+        text = f"Mock Leaf\n{ts}"
+        draw.text((20, 20), text, fill=(255, 255, 255))
+        if get_turbojpeg() is not None:
+            import numpy as np
+            self._mock_jpeg = encode_jpeg(np.asarray(img), quality=90, rgb=True)
+        else:
+            bio = io.BytesIO()
+            img.save(bio, format="JPEG", quality=90)
+            self._mock_jpeg = bio.getvalue()
+        self._mock_ts = ts
+        return self._mock_jpeg
+
     def capture_image(self) -> str:
         """
         Capture image depending on active source.
@@ -66,23 +157,37 @@ class CameraService:
         image_dir = current_app.config.get("IMAGE_DIR", "images")
         os.makedirs(image_dir, exist_ok=True)
 
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_path = os.path.join(image_dir, f"capture_{ts}.jpg")
+        now = int(time.time())
+        ts = self._format_ts(now)
+        # Disambiguate several captures within the same second
+        if now == self._last_capture_sec:
+            self._capture_seq += 1
+        else:
+            self._last_capture_sec = now
+            self._capture_seq = 0
+        suffix = f"_{self._capture_seq}" if self._capture_seq else ""
+        file_path = os.path.join(image_dir, f"capture_{ts}{suffix}.jpg")
 
-        # Raspberry Pi camera
+        # Raspberry Pi camera: encode the captured array in memory rather than via capture_file
         if self.source == "picamera2" and self._picam2 is not None:
             try:
-                self._picam2.capture_file(file_path)
-                return file_path
+                frame = self.capture_array()
+                data = encode_jpeg(frame, quality=95) if frame is not None else None
+                if data is not None:
+                    with open(file_path, "wb") as f:
+                        f.write(data)
+                    return file_path
             except Exception as exc:
                 print(f"[CameraService] PiCamera2 capture failed: {exc}")
 
         # OpenCV webcam
         if self.source == "opencv" and self._cv2 is not None and self._cap is not None:
             try:
-                ret, frame = self._cap.read()
-                if ret:
-                    self._cv2.imwrite(file_path, frame)
+                frame = self._read_frame()
+                data = encode_jpeg(frame, quality=95) if frame is not None else None
+                if data is not None:
+                    with open(file_path, "wb") as f:
+                        f.write(data)
                     return file_path
                 else:
                     print("[CameraService] OpenCV capture failed")
@@ -90,38 +195,89 @@ class CameraService:
                 print(f"[CameraService] OpenCV capture exception: {exc}")
 
         # Mock image fallback
-        img = Image.new("RGB", (640, 480), color=(60, 120, 60))
-        draw = ImageDraw.Draw(img)
-        text = f"Mock Leaf\n{ts}"
-        draw.text((20, 20), text, fill=(255, 255, 255))
-        img.save(file_path, format="JPEG", quality=90)
+        with open(file_path, "wb") as f:
+            f.write(self._render_mock(ts))
         return file_path
 
+    def capture_array(self):
+        """
+        Capture a raw BGR frame as a numpy array, skipping JPEG encode and disk I/O.
+        Returns None if no frame is available.
+        """
+        # Raspberry Pi camera: a copy of the main stream's buffer (capture_array does not return a view)
+        if self.source == "picamera2" and self._picam2 is not None:
+            try:
+                return self._picam2.capture_array("main")
+            except Exception as exc:
+                print(f"[CameraService] PiCamera2 capture failed: {exc}")
+                return None
+
+        # OpenCV webcam
+        if self.source == "opencv" and self._cv2 is not None and self._cap is not None:
+            return self._read_frame()
+
+        # Mock image fallback
+        import numpy as np
+        if self._mock_base is None:
+            from PIL import Image
+            self._mock_base = Image.new("RGB", (640, 480), color=(60, 120, 60))
+        return np.asarray(self._mock_base)[:, :, ::-1].copy()
+
+    def capture_image_bytes(self) -> Union[bytes, memoryview]:
+        """
+        Capture a JPEG frame into memory without touching the filesystem.
+        """
+        ts = self._format_ts(int(time.time()))
+
+        # Raspberry Pi camera
+        if self.source == "picamera2" and self._picam2 is not None:
+            try:
+                bio = io.BytesIO()
+                self._picam2.capture_file(bio, format="jpeg")
+                return bio.getvalue()
+            except Exception as exc:
+                print(f"[CameraService] PiCamera2 capture failed: {exc}")
+
+        # OpenCV webcam
+        if self.source == "opencv" and self._cv2 is not None and self._cap is not None:
+            try:
+                frame = self._read_frame()
+                data = encode_jpeg(frame, quality=85) if frame is not None else None
+                if data is not None:
+                    return data
+                print("[CameraService] OpenCV capture failed")
+            except Exception as exc:
+                print(f"[CameraService] OpenCV capture exception: {exc}")
+
+        # Mock image fallback
+        return self._render_mock(ts)
+
+
+_camera_lock = threading.Lock()
+
 
-_camera_instance: Optional[CameraService] = None
+@cache
+def _create_camera() -> CameraService:
+    source = current_app.config.get("CAMERA_SOURCE", None)
+    return CameraService(source)
 
 
 def get_camera() -> CameraService:
     """
-    Singleton accessor for CameraService.
+    Singleton accessor for CameraService (reset with _create_camera.cache_clear()).
+    The lock keeps concurrent first requests from opening the camera twice.
     Source priority:
     - Config["CAMERA_SOURCE"] if set
     - Auto-detect otherwise
     """
-    global _camera_instance
-    if _camera_instance is None:
-        source = current_app.config.get("CAMERA_SOURCE", None)
-        _camera_instance = CameraService(source)
-    return _camera_instance
+    with _camera_lock:
+        return _create_camera()
 
 
 # Optional: Video feed generator for Flask streaming
 def generate_video():
     camera = get_camera()
     while True:
-        frame_path = camera.capture_image()
-        with open(frame_path, "rb") as f:
-            frame_bytes = f.read()
-        yield (b"--frame\r\n"
-               b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n")
+        frame_bytes = camera.capture_image_bytes()
+        yield MJPEG_PART_HEADER + frame_bytes + b"\r\n"
         time.sleep(0.1)  # Limit FPS
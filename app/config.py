@@ -27,5 +27,10 @@ def load_config(app):
         SPRAY_DURATION_LOW_MS=int(os.environ.get("SPRAY_DURATION_LOW_MS", 2000)),
         SPRAY_DURATION_HIGH_MS=int(os.environ.get("SPRAY_DURATION_HIGH_MS", 5000)),
         GPIO_PIN_SPRAYER=int(os.environ.get("GPIO_PIN_SPRAYER", 17)),  # BCM pin
+        VIDEO_SOURCE=os.environ.get("VIDEO_SOURCE", "opencv"),  # opencv|picamera2
+        VIDEO_HLS_ENABLED=os.environ.get("VIDEO_HLS_ENABLED", "false").lower() in ("1", "true", "yes"),
+        VIDEO_HLS_DIR=os.environ.get("VIDEO_HLS_DIR", os.path.join(data_dir, "hls")),  # picamera2 H.264 HLS output
+        LEAF_DETECTOR_MODEL=os.environ.get("LEAF_DETECTOR_MODEL", "caffe"),  # caffe (FP32 MobileNet-SSD)|tflite_int8
+        LEAF_DETECTOR_TFLITE_PATH=os.environ.get("LEAF_DETECTOR_TFLITE_PATH", os.path.join(base_dir, "models", "leaf_ssd_int8.tflite")),
         STATIC_URL_PATH=os.environ.get("STATIC_URL_PATH", "/static"),
     ) 
\ No newline at end of file
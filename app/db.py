@@ -1,19 +1,71 @@
+import atexit
+import json
+import queue
 import sqlite3
 import os
-from typing import Any, Dict, Optional, Tuple
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 from flask import current_app, g
 
+try:
+    import orjson  # type: ignore
+except ImportError:  # optional; stdlib json is the fallback
+    orjson = None
+
+# Statements are module constants so every call hands sqlite3 the same string
+# and hits the connection's prepared-statement cache.
+SQL_INSERT_CAPTURE = "INSERT INTO captures (image_path) VALUES (?)"
+SQL_INSERT_DETECTION = "INSERT INTO detections (capture_id, disease, severity, raw_json) VALUES (?, ?, ?, ?)"
+SQL_INSERT_ACTION = "INSERT INTO actions (detection_id, action, duration_ms) VALUES (?, ?, ?)"
+SQL_RECENT_CAPTURES = "SELECT * FROM captures ORDER BY id DESC LIMIT ?"
+SQL_RECENT_DETECTIONS = (
+    "SELECT d.id, d.capture_id, d.disease, d.severity, d.created_at, c.image_path "
+    "FROM detections d JOIN captures c ON d.capture_id = c.id ORDER BY d.id DESC LIMIT ?"
+)
+SQL_RECENT_ACTIONS = (
+    "SELECT a.id, a.detection_id, a.action, a.duration_ms, a.created_at, d.disease, d.severity "
+    "FROM actions a JOIN detections d ON a.detection_id = d.id ORDER BY a.id DESC LIMIT ?"
+)
+
+
+# Background writer: (DATABASE_PATH, [record_cycle_async args, ...]) jobs, drained by one daemon thread
+_writer_queue: "queue.Queue[Tuple[str, List[tuple]]]" = queue.Queue()
+_writer_lock = threading.Lock()
+_writer_thread: Optional[threading.Thread] = None
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    # Autocommit mode: multi-statement writes use explicit BEGIN/COMMIT
+    conn = sqlite3.connect(
+        db_path,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=128,
+        isolation_level=None,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
 
 def get_db() -> sqlite3.Connection:
     if "db" not in g:
-        db_path = current_app.config["DATABASE_PATH"]
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
-        conn.row_factory = sqlite3.Row
-        g.db = conn
+        g.db = _connect(current_app.config["DATABASE_PATH"])
     return g.db  # type: ignore
 
 
+def dumps_json(obj: Any) -> str:
+    """Serialize to a JSON string with orjson when installed (numpy values included), stdlib json otherwise."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj)
+
+
 def close_db(_e: Optional[BaseException] = None) -> None:
     db: Optional[sqlite3.Connection] = g.pop("db", None)  # type: ignore
     if db is not None:
@@ -49,6 +101,9 @@ def init_db(app) -> None:
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(detection_id) REFERENCES detections(id)
             );
+
+            CREATE INDEX IF NOT EXISTS idx_detections_capture ON detections(capture_id);
+            CREATE INDEX IF NOT EXISTS idx_actions_detection ON actions(detection_id);
             """
         )
         db.commit()
@@ -58,40 +113,116 @@ def init_db(app) -> None:
 
 def insert_capture(image_path: str) -> int:
     db = get_db()
-    cur = db.execute("INSERT INTO captures (image_path) VALUES (?)", (image_path,))
-    db.commit()
+    cur = db.execute(SQL_INSERT_CAPTURE, (image_path,))
     return int(cur.lastrowid)
 
 
 def insert_detection(capture_id: int, disease: str, severity: float, raw_json: str) -> int:
     db = get_db()
-    cur = db.execute(
-        "INSERT INTO detections (capture_id, disease, severity, raw_json) VALUES (?, ?, ?, ?)",
-        (capture_id, disease, severity, raw_json),
-    )
-    db.commit()
+    cur = db.execute(SQL_INSERT_DETECTION, (capture_id, disease, severity, raw_json))
     return int(cur.lastrowid)
 
 
 def insert_action(detection_id: int, action: str, duration_ms: int) -> int:
     db = get_db()
-    cur = db.execute(
-        "INSERT INTO actions (detection_id, action, duration_ms) VALUES (?, ?, ?)",
-        (detection_id, action, duration_ms),
-    )
-    db.commit()
+    cur = db.execute(SQL_INSERT_ACTION, (detection_id, action, duration_ms))
     return int(cur.lastrowid)
 
 
+def _insert_cycle(
+    db: sqlite3.Connection, image_path: str, disease: str, severity: float, raw_json: str, action: str, duration_ms: int
+) -> Tuple[int, int, int]:
+    capture_id = int(db.execute(SQL_INSERT_CAPTURE, (image_path,)).lastrowid)
+    detection_id = int(db.execute(SQL_INSERT_DETECTION, (capture_id, disease, severity, raw_json)).lastrowid)
+    action_id = int(db.execute(SQL_INSERT_ACTION, (detection_id, action, duration_ms)).lastrowid)
+    return capture_id, detection_id, action_id
+
+
+def record_cycle_async(
+    image_path: str, disease: str, severity: float, raw: Any, action: str, duration_ms: int
+) -> None:
+    """
+    Queue a cycle for the background writer and return immediately.
+    raw is the detection payload; it is JSON-serialized on the writer thread.
+    """
+    record_cycles_async([(image_path, disease, severity, raw, action, duration_ms)])
+
+
+def record_cycles_async(cycles: List[tuple]) -> None:
+    """
+    Queue several cycles, each (image_path, disease, severity, raw, action, duration_ms),
+    as one job; the writer always commits a job's cycles in the same transaction.
+    """
+    if not cycles:
+        return
+    _ensure_writer()
+    _writer_queue.put((current_app.config["DATABASE_PATH"], list(cycles)))
+
+
+def flush_writes() -> None:
+    """Block until every queued job has been committed."""
+    _writer_queue.join()
+
+
+def _ensure_writer() -> None:
+    global _writer_thread
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+            _writer_thread.start()
+            # Don't drop queued rows on a clean interpreter exit
+            atexit.register(flush_writes)
+
+
+def _writer_loop() -> None:
+    """Drain the queue, committing every job that is waiting in one transaction per database."""
+    conns: Dict[str, sqlite3.Connection] = {}
+    while True:
+        batch = [_writer_queue.get()]
+        while True:
+            try:
+                batch.append(_writer_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        by_path: Dict[str, list] = {}
+        for db_path, cycles in batch:
+            by_path.setdefault(db_path, []).extend(cycles)
+
+        for db_path, rows in by_path.items():
+            # Serialize before BEGIN so one bad payload is skipped without rolling back the rest
+            ready = []
+            for image_path, disease, severity, raw, action, duration_ms in rows:
+                try:
+                    ready.append((image_path, disease, severity, dumps_json(raw), action, duration_ms))
+                except Exception as exc:
+                    print(f"[db] Dropping cycle for {image_path}: detection payload is not JSON-serializable: {exc}")
+            if not ready:
+                continue
+            try:
+                db = conns.get(db_path)
+                if db is None:
+                    db = conns[db_path] = _connect(db_path)
+                db.execute("BEGIN")
+                try:
+                    for row in ready:
+                        _insert_cycle(db, *row)
+                except BaseException:
+                    db.execute("ROLLBACK")
+                    raise
+                db.execute("COMMIT")
+            except Exception as exc:
+                print(f"[db] Background write of {len(ready)} cycle(s) failed: {exc}")
+
+        for _ in batch:
+            _writer_queue.task_done()
+
+
 def get_recent(limit: int = 20) -> Tuple[list, list, list]:
     db = get_db()
-    captures = db.execute("SELECT * FROM captures ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
-    detections = db.execute(
-        "SELECT d.*, c.image_path FROM detections d JOIN captures c ON d.capture_id = c.id ORDER BY d.id DESC LIMIT ?",
-        (limit,),
-    ).fetchall()
-    actions = db.execute(
-        "SELECT a.*, d.disease, d.severity FROM actions a JOIN detections d ON a.detection_id = d.id ORDER BY a.id DESC LIMIT ?",
-        (limit,),
-    ).fetchall()
+    captures = db.execute(SQL_RECENT_CAPTURES, (limit,)).fetchall()
+    detections = db.execute(SQL_RECENT_DETECTIONS, (limit,)).fetchall()
+    actions = db.execute(SQL_RECENT_ACTIONS, (limit,)).fetchall()
     return list(captures), list(detections), list(actions) 
\ No newline at end of file
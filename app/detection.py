@@ -1,18 +1,44 @@
 import json
 import random
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 from flask import current_app
-import requests
 
 
 def detect_disease(image_path: str) -> Tuple[str, float, Dict]:
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    return _detect(image_bytes, image_path)
+
+
+def detect_disease_from_array(frame, save_path: Optional[str] = None) -> Tuple[str, float, Dict]:
+    """
+    Detect disease in a BGR ndarray (e.g. a leaf crop) without a file round-trip.
+    The frame is JPEG-encoded once; pass save_path to also keep that JPEG on disk.
+    """
+    from .jpeg import encode_jpeg
+
+    image_bytes = encode_jpeg(frame, quality=90)
+    if image_bytes is None:
+        raise ValueError("JPEG encoding failed")
+    return detect_disease_from_jpeg(image_bytes, save_path)
+
+
+def detect_disease_from_jpeg(image_bytes, save_path: Optional[str] = None) -> Tuple[str, float, Dict]:
+    """Detect disease in already-encoded JPEG bytes; pass save_path to also keep them on disk."""
+    if save_path:
+        with open(save_path, "wb") as f:
+            f.write(image_bytes)
+    return _detect(image_bytes, save_path or "<array>")
+
+
+def _detect(image_bytes: bytes, image_path: str) -> Tuple[str, float, Dict]:
     backend = current_app.config["DETECTION_BACKEND"]
     if backend == "plantid":
-        return _detect_with_plantid(image_path)
+        return _detect_with_plantid(image_bytes, image_path)
     elif backend == "tflite":
-        return _detect_with_tflite(image_path)
+        return _detect_with_tflite(image_bytes, image_path)
     elif backend == "gemini":
-        return _detect_with_gemini(image_path)
+        return _detect_with_gemini(image_bytes, image_path)
     else:
         return _detect_mock(image_path)
 
@@ -25,12 +51,14 @@ def _detect_mock(image_path: str) -> Tuple[str, float, Dict]:
     return disease, severity, data
 
 
-def _detect_with_plantid(image_path: str) -> Tuple[str, float, Dict]:
+def _detect_with_plantid(image_bytes: bytes, image_path: str) -> Tuple[str, float, Dict]:
     api_key = current_app.config.get("PLANT_ID_API_KEY", "")
     if not api_key:
         return _detect_mock(image_path)
+    import requests  # only this backend needs it; keeps it off the app import path
+
     url = "https://api.plant.id/v3/health_assessment"
-    files = {"images": open(image_path, "rb")}
+    files = {"images": ("leaf.jpg", image_bytes, "image/jpeg")}
     payload = {"similar_images": False}
     headers = {"Api-Key": api_key}
     try:
@@ -45,12 +73,12 @@ def _detect_with_plantid(image_path: str) -> Tuple[str, float, Dict]:
         return _detect_mock(image_path)
 
 
-def _detect_with_tflite(image_path: str) -> Tuple[str, float, Dict]:
+def _detect_with_tflite(image_bytes: bytes, image_path: str) -> Tuple[str, float, Dict]:
     # Placeholder: implement TFLite inference if model is available
     return _detect_mock(image_path)
 
 
-def _detect_with_gemini(image_path: str) -> Tuple[str, float, Dict]:
+def _detect_with_gemini(image_bytes: bytes, image_path: str) -> Tuple[str, float, Dict]:
     api_key = current_app.config.get("GEMINI_API_KEY", "")
     model_name = current_app.config.get("GEMINI_MODEL", "gemini-1.5-pro")
     if not api_key:
@@ -64,10 +92,8 @@ def _detect_with_gemini(image_path: str) -> Tuple[str, float, Dict]:
             "respond with a compact JSON object with keys 'disease' (string) and 'severity' (number 0-100). "
             "If healthy, set disease='healthy' and severity=0."
         )
-        with open(image_path, "rb") as f:
-            image_bytes = f.read()
         result = model.generate_content([
-            {"mime_type": "image/jpeg", "data": image_bytes},
+            {"mime_type": "image/jpeg", "data": bytes(image_bytes)},
             prompt,
         ])
         text = result.text or "{}"
@@ -1,5 +1,7 @@
+import threading
 import time
-from typing import Optional
+from functools import cache
+from typing import List, Optional, Tuple
 from flask import current_app
 
 
@@ -16,23 +18,85 @@ class SprayerController:
         except Exception:
             self._gpio = None
 
-    def spray_for_ms(self, duration_ms: int) -> None:
-        if duration_ms <= 0:
-            return
+        # Sprays run one at a time on a worker thread so callers are not held for the duration.
+        # At most one spray waits behind the running one; later requests merge into it, so a
+        # burst of detections cannot build a backlog that keeps the nozzle firing.
+        self._cond = threading.Condition()
+        self._pending: Optional[Tuple[int, List[threading.Event]]] = None
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                (duration_ms, waiters), self._pending = self._pending, None
+            try:
+                self._spray(duration_ms)
+            except Exception as exc:
+                print(f"[SprayerController] Spray failed: {exc}")
+            finally:
+                for done in waiters:
+                    done.set()
+
+    def _spray(self, duration_ms: int) -> None:
         if self._gpio is None:
             # Simulation on non-Pi
             time.sleep(duration_ms / 1000.0)
             return
         self._gpio.output(self.pin, self._gpio.HIGH)
-        time.sleep(duration_ms / 1000.0)
-        self._gpio.output(self.pin, self._gpio.LOW)
+        try:
+            time.sleep(duration_ms / 1000.0)
+        finally:
+            self._gpio.output(self.pin, self._gpio.LOW)
 
+    def spray_async(self, duration_ms: int) -> threading.Event:
+        """
+        Queue a spray and return immediately; the returned event is set when it has finished.
+        If a spray is already waiting, this one is merged into it (the longer duration wins).
+        """
+        done = threading.Event()
+        if duration_ms <= 0:
+            done.set()
+            return done
+        with self._cond:
+            if self._pending is None:
+                self._pending = (duration_ms, [done])
+            else:
+                pending_ms, waiters = self._pending
+                self._pending = (max(pending_ms, duration_ms), waiters + [done])
+            self._cond.notify()
+        return done
 
-_sprayer_instance: Optional[SprayerController] = None
+    def cancel_pending(self) -> None:
+        """Drop the waiting spray, if any; a spray already running is left to finish."""
+        with self._cond:
+            if self._pending is not None:
+                for done in self._pending[1]:
+                    done.set()
+                self._pending = None
+
+    def spray_for_ms(self, duration_ms: int) -> None:
+        """Spray and block until the spray has finished."""
+        self.spray_async(duration_ms).wait()
+
+
+_sprayer_lock = threading.Lock()
+
+
+@cache
+def _create_sprayer() -> SprayerController:
+    return SprayerController(current_app.config["GPIO_PIN_SPRAYER"])
 
 
 def get_sprayer() -> SprayerController:
-    global _sprayer_instance
-    if _sprayer_instance is None:
-        _sprayer_instance = SprayerController(current_app.config["GPIO_PIN_SPRAYER"])
-    return _sprayer_instance 
\ No newline at end of file
+    # Locked so concurrent first calls cannot start a second worker thread
+    with _sprayer_lock:
+        return _create_sprayer()
+
+
+def cancel_pending_sprays() -> None:
+    """Drop any waiting spray without creating the sprayer if it was never used."""
+    with _sprayer_lock:
+        if _create_sprayer.cache_info().currsize:
+            _create_sprayer().cancel_pending()
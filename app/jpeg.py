@@ -0,0 +1,42 @@
+"""
+JPEG encoding shared by the camera, streaming and detection paths.
+Uses libjpeg-turbo through PyTurboJPEG when it is installed, OpenCV otherwise.
+"""
+from functools import cache
+from typing import Optional, Union
+
+# multipart/x-mixed-replace part header for MJPEG streams, built once
+MJPEG_PART_HEADER = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+
+
+@cache
+def get_turbojpeg():
+    """Shared TurboJPEG encoder, or None when PyTurboJPEG/libturbojpeg is unavailable"""
+    try:
+        from turbojpeg import TurboJPEG  # type: ignore
+        return TurboJPEG()
+    except Exception as exc:
+        print(f"[jpeg] PyTurboJPEG unavailable, using OpenCV encoder: {exc}")
+        return None
+
+
+def encode_jpeg(frame, quality: int = 85, rgb: bool = False, fast_dct: bool = False) -> Optional[Union[bytes, memoryview]]:
+    """
+    Encode an 8-bit BGR frame (RGB when rgb=True) to JPEG; None if encoding fails.
+    The OpenCV path returns a memoryview over the encoded buffer instead of copying it.
+    """
+    tj = get_turbojpeg()
+    if tj is not None:
+        from turbojpeg import TJFLAG_FASTDCT, TJPF_BGR, TJPF_RGB  # type: ignore
+        return tj.encode(
+            frame,
+            quality=quality,
+            pixel_format=TJPF_RGB if rgb else TJPF_BGR,
+            flags=TJFLAG_FASTDCT if fast_dct else 0,
+        )
+
+    import cv2
+    if rgb:
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buf.reshape(-1).data if ok else None
@@ -1,25 +1,47 @@
-import cv2
-import numpy as np
-import time
-from typing import List, Tuple, Optional
+from __future__ import annotations
+
+import platform
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cache
+from typing import TYPE_CHECKING, List, Tuple, Optional
 import os
-import requests
 import json
-from flask import current_app
+from flask import current_app, has_app_context
+
+# cv2 and numpy are imported where they are used so that importing
+# the app (and Flask cold start) does not pay for loading OpenCV.
+if TYPE_CHECKING:
+    import numpy as np
 
 
 class MobileNetSSDLeafDetector:
     """MobileNet-SSD based leaf detector for automatic leaf detection in video frames"""
     
+    # Fallback detection: HSV green range and morphology kernel size
+    LOWER_GREEN = (35, 50, 50)
+    UPPER_GREEN = (85, 255, 255)
+    MORPH_KERNEL_SIZE = 5
+    FALLBACK_MAX_HEIGHT = 480  # Larger frames are downscaled before segmentation
+    _green_lut = None  # 64x64x64 BGR -> green mask table, built on first use
+    
     def __init__(self, confidence_threshold: float = 0.5):
+        import numpy as np
+        
         self.confidence_threshold = confidence_threshold
         self.net = None
         self.class_names = ['background', 'leaf']  # Simplified for leaf detection
         self.is_initialized = False
+        # Reusable input buffers for the 300x300 network input
+        self._resize_buf = np.empty((300, 300, 3), np.uint8)
+        self._blob = np.empty((1, 3, 300, 300), np.float32)
+        self._morph_kernel = np.ones((self.MORPH_KERNEL_SIZE, self.MORPH_KERNEL_SIZE), np.uint8)
         
     def initialize_model(self, model_path: str = None, config_path: str = None):
         """Initialize MobileNet-SSD model"""
         try:
+            import cv2
+            
             # Try to load pre-trained model if available
             if model_path and os.path.exists(model_path):
                 self.net = cv2.dnn.readNetFromCaffe(config_path, model_path)
@@ -32,6 +54,7 @@ class MobileNetSSDLeafDetector:
                 )
                 print("Loaded OpenCV MobileNet-SSD model")
             
+            self._configure_backend()
             self.is_initialized = True
             return True
         except Exception as e:
@@ -40,84 +63,107 @@ class MobileNetSSDLeafDetector:
             self.is_initialized = False
             return False
     
-    def detect_leaves(self, frame: np.ndarray) -> List[Tuple[int, int, int, int, float]]:
-        """Detect leaves in frame and return bounding boxes with confidence scores"""
+    def _configure_backend(self):
+        """Pick the DNN backend/target; FP16 on ARM CPUs where this OpenCV build supports it"""
+        import cv2
+        
+        try:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            fp16_target = getattr(cv2.dnn, 'DNN_TARGET_CPU_FP16', None)
+            if fp16_target is not None and platform.machine() in ('aarch64', 'arm64', 'armv7l'):
+                self.net.setPreferableTarget(fp16_target)
+                print("MobileNet-SSD using CPU FP16 target")
+            else:
+                self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        except (AttributeError, cv2.error) as e:
+            print(f"Could not set DNN backend, using defaults: {e}")
+    
+    def detect_leaves(self, frame: np.ndarray,
+                      scale: Tuple[float, float] = (1.0, 1.0)) -> List[Tuple[int, int, int, int, float]]:
+        """
+        Detect leaves in frame and return bounding boxes with confidence scores.
+        scale is the (x, y) factor frame was already downscaled by, so that the size
+        thresholds stay in full-resolution pixels; boxes are in frame coordinates.
+        """
         if not self.is_initialized or self.net is None:
             # Fallback to basic contour detection
-            return self._fallback_leaf_detection(frame)
+            return self._fallback_leaf_detection(frame, scale)
         
         try:
-            # Prepare input blob
-            blob = cv2.dnn.blobFromImage(
-                cv2.resize(frame, (300, 300)), 
-                0.007843, 
-                (300, 300), 
-                127.5
-            )
+            import cv2
+            import numpy as np
+            
+            # Prepare input blob in place: (pixel - 127.5) * 0.007843, HWC -> NCHW
+            cv2.resize(frame, (300, 300), dst=self._resize_buf)
+            np.subtract(self._resize_buf.transpose(2, 0, 1), 127.5, out=self._blob[0])
+            self._blob *= 0.007843
             
             # Forward pass
-            self.net.setInput(blob)
+            self.net.setInput(self._blob)
             detections = self.net.forward()
             
-            # Process detections
-            leaves = []
-            height, width = frame.shape[:2]
+            # Process detections: rows are (image_id, class_id, confidence, x1, y1, x2, y2)
+            d = detections[0, 0]
             
-            for i in range(detections.shape[2]):
-                confidence = detections[0, 0, i, 2]
-                
-                if confidence > self.confidence_threshold:
-                    class_id = int(detections[0, 0, i, 1])
-                    
-                    # Filter for leaf class (assuming class_id 1 is leaf)
-                    if class_id == 1:  # Adjust based on your model's class mapping
-                        # Get bounding box coordinates
-                        x1 = int(detections[0, 0, i, 3] * width)
-                        y1 = int(detections[0, 0, i, 4] * height)
-                        x2 = int(detections[0, 0, i, 5] * width)
-                        y2 = int(detections[0, 0, i, 6] * height)
-                        
-                        # Ensure coordinates are within frame bounds
-                        x1 = max(0, x1)
-                        y1 = max(0, y1)
-                        x2 = min(width, x2)
-                        y2 = min(height, y2)
-                        
-                        # Only add if bounding box is large enough
-                        if (x2 - x1) > 50 and (y2 - y1) > 50:
-                            leaves.append((x1, y1, x2, y2, confidence))
+            # Keep confident leaf-class rows (assuming class_id 1 is leaf; adjust to your model's mapping)
+            d = d[(d[:, 2] > self.confidence_threshold) & (d[:, 1].astype(np.int32) == 1)]
             
-            return leaves
+            return self._to_leaves(d[:, 3:7], d[:, 2], frame.shape, scale)
             
         except Exception as e:
             print(f"Error in MobileNet-SSD detection: {e}")
-            return self._fallback_leaf_detection(frame)
+            return self._fallback_leaf_detection(frame, scale)
+    
+    @staticmethod
+    def _to_leaves(boxes: np.ndarray, scores: np.ndarray, shape,
+                   scale: Tuple[float, float] = (1.0, 1.0)) -> List[Tuple[int, int, int, int, float]]:
+        """Scale normalized (x1, y1, x2, y2) boxes to pixels, clip them and drop boxes 50 full-res px or smaller"""
+        import numpy as np
+        
+        height, width = shape[:2]
+        bounds = np.array([width, height, width, height])
+        xyxy = np.clip((boxes * bounds).astype(np.int32), 0, bounds)
+        
+        # Only keep boxes that are large enough (in full-resolution pixels)
+        wh = xyxy[:, 2:] - xyxy[:, :2]
+        keep = (wh[:, 0] > 50 * scale[0]) & (wh[:, 1] > 50 * scale[1])
+        
+        return [
+            (x1, y1, x2, y2, confidence)
+            for (x1, y1, x2, y2), confidence in zip(xyxy[keep].tolist(), scores[keep].tolist())
+        ]
     
-    def _fallback_leaf_detection(self, frame: np.ndarray) -> List[Tuple[int, int, int, int, float]]:
+    def _fallback_leaf_detection(self, frame: np.ndarray,
+                                 scale: Tuple[float, float] = (1.0, 1.0)) -> List[Tuple[int, int, int, int, float]]:
         """Fallback method using basic image processing for leaf detection"""
         try:
-            # Convert to HSV for better leaf detection
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            import cv2
             
-            # Define green color range for leaves
-            lower_green = np.array([35, 50, 50])
-            upper_green = np.array([85, 255, 255])
+            # Segment on a downscaled copy of large frames; boxes are scaled back below
+            height = frame.shape[0]
+            shrink = 1.0
+            if height > self.FALLBACK_MAX_HEIGHT:
+                shrink = self.FALLBACK_MAX_HEIGHT / height
+                frame = cv2.resize(frame, (0, 0), fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+            # Also undo any downscale the caller applied before handing us the frame
+            area_scale = shrink * shrink * scale[0] * scale[1]
             
-            # Create mask for green regions
-            mask = cv2.inRange(hsv, lower_green, upper_green)
+            # Create mask for green regions: look up each BGR pixel (6 bits per channel)
+            # in the precomputed HSV-range table instead of converting the frame to HSV
+            b, g, r = cv2.split(frame)
+            mask = self._get_green_lut()[b >> 2, g >> 2, r >> 2]
             
             # Apply morphological operations to clean up mask
-            kernel = np.ones((5, 5), np.uint8)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self._morph_kernel)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._morph_kernel)
             
             # Find contours
             contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
             leaves = []
             for contour in contours:
-                # Filter contours by area
-                area = cv2.contourArea(contour)
+                # Filter contours by area (in full-resolution pixels)
+                area = cv2.contourArea(contour) / area_scale
                 if area > 1000:  # Minimum area threshold
                     # Get bounding rectangle
                     x, y, w, h = cv2.boundingRect(contour)
@@ -128,7 +174,13 @@ class MobileNetSSDLeafDetector:
                     
                     # Only add if aspect ratio is reasonable for leaves
                     if 0.3 < aspect_ratio < 3.0:
-                        leaves.append((x, y, x + w, y + h, confidence))
+                        leaves.append((
+                            int(x / shrink),
+                            int(y / shrink),
+                            int((x + w) / shrink),
+                            int((y + h) / shrink),
+                            confidence
+                        ))
             
             return leaves
             
@@ -136,18 +188,41 @@ class MobileNetSSDLeafDetector:
             print(f"Error in fallback detection: {e}")
             return []
     
+    @classmethod
+    def _get_green_lut(cls) -> np.ndarray:
+        """Build (once) a 256 KB table mapping quantised BGR colours to the HSV green mask"""
+        if cls._green_lut is None:
+            import cv2
+            import numpy as np
+            
+            # Evaluate the HSV range at the centre of every 4-wide bin of each channel
+            levels = (np.arange(64, dtype=np.uint8) << 2) | 2
+            b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+            bgr = np.stack([b, g, r], axis=-1).reshape(-1, 1, 3)
+            hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+            lower = np.array(cls.LOWER_GREEN, dtype=np.uint8)
+            upper = np.array(cls.UPPER_GREEN, dtype=np.uint8)
+            cls._green_lut = cv2.inRange(hsv, lower, upper).reshape(64, 64, 64)
+        return cls._green_lut
+    
     def crop_leaf(self, frame: np.ndarray, bbox: Tuple[int, int, int, int]) -> np.ndarray:
         """Crop leaf region from frame based on bounding box"""
         x1, y1, x2, y2 = bbox
         return frame[y1:y2, x1:x2]
     
-    def resize_leaf(self, leaf_crop: np.ndarray, target_size: Tuple[int, int] = (224, 224)) -> np.ndarray:
-        """Resize cropped leaf to target size for API compatibility"""
-        return cv2.resize(leaf_crop, target_size)
+    def resize_leaf(self, leaf_crop: np.ndarray, target_size: Tuple[int, int] = (224, 224),
+                    dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Resize cropped leaf to target size for API compatibility, optionally into a reusable buffer"""
+        import cv2
+        
+        return cv2.resize(leaf_crop, target_size, dst=dst)
     
-    def draw_detections(self, frame: np.ndarray, detections: List[Tuple[int, int, int, int, float]]) -> np.ndarray:
-        """Draw detection bounding boxes on frame"""
-        annotated_frame = frame.copy()
+    def draw_detections(self, frame: np.ndarray, detections: List[Tuple[int, int, int, int, float]],
+                        inplace: bool = False) -> np.ndarray:
+        """Draw detection bounding boxes on frame (on a copy unless inplace=True)"""
+        import cv2
+        
+        annotated_frame = frame if inplace else frame.copy()
         
         for i, (x1, y1, x2, y2, confidence) in enumerate(detections):
             # Draw bounding box
@@ -162,18 +237,138 @@ class MobileNetSSDLeafDetector:
         return annotated_frame
 
 
+class TFLiteSSDLeafDetector(MobileNetSSDLeafDetector):
+    """
+    INT8-quantized SSD leaf detector on the TFLite interpreter (XNNPACK CPU kernels).
+    Expects the standard TFLite detection post-process outputs: boxes, classes, scores, count.
+    """
+    
+    LEAF_CLASS_ID = 0  # TFLite SSD labels are 0-based; adjust to your model's mapping
+    NUM_THREADS = 4
+    
+    def __init__(self, confidence_threshold: float = 0.5):
+        super().__init__(confidence_threshold)
+        self.interpreter = None
+        self._input = None
+        self._input_index = None
+        self._output_indices = ()
+    
+    def initialize_model(self, model_path: str = None, config_path: str = None):
+        """Load a pre-quantized .tflite model and preallocate its uint8 input tensor"""
+        try:
+            import numpy as np
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                from tensorflow.lite import Interpreter  # type: ignore
+            
+            if not model_path or not os.path.exists(model_path):
+                raise FileNotFoundError(f"TFLite model not found: {model_path}")
+            
+            # XNNPACK is the interpreter's default CPU delegate for float and INT8 models
+            self.interpreter = Interpreter(model_path=model_path, num_threads=self.NUM_THREADS)
+            self.interpreter.allocate_tensors()
+            
+            inp = self.interpreter.get_input_details()[0]
+            if inp['dtype'] != np.uint8:
+                raise ValueError(f"Expected a uint8-quantized input tensor, got {inp['dtype']}")
+            self._input_index = inp['index']
+            self._input = np.empty(inp['shape'], np.uint8)
+            self._output_indices = self._identify_outputs(self.interpreter.get_output_details())
+            
+            self.net = self.interpreter
+            self.is_initialized = True
+            print(f"Loaded INT8 TFLite leaf detector: {model_path}")
+            return True
+        except Exception as e:
+            print(f"Failed to initialize TFLite leaf detector: {e}")
+            self.is_initialized = False
+            return False
+    
+    @staticmethod
+    def _identify_outputs(details: List[dict]) -> Tuple[int, int, int]:
+        """
+        Find the (boxes, classes, scores) output indices. Boxes are the [1, N, 4] tensor;
+        classes/scores are matched by name, since exports list outputs in different orders.
+        Raises ValueError when they cannot be told apart, so the FP32 model is used instead.
+        """
+        boxes = [d for d in details if len(d['shape']) == 3 and d['shape'][-1] == 4]
+        per_box = [d for d in details if len(d['shape']) == 2]
+        
+        named = {}
+        for d in per_box:
+            name = d['name'].lower()
+            if 'score' in name:
+                named['scores'] = d
+            elif 'class' in name:
+                named['classes'] = d
+            elif name == 'tflite_detection_postprocess:1':
+                named.setdefault('classes', d)  # TF1 SSD post-process outputs: boxes, :1 classes, :2 scores, :3 count
+            elif name == 'tflite_detection_postprocess:2':
+                named.setdefault('scores', d)
+        
+        if len(boxes) != 1 or 'classes' not in named or 'scores' not in named:
+            found = [(d['name'], [int(n) for n in d['shape']]) for d in details]
+            raise ValueError(f"Cannot identify boxes/classes/scores among TFLite outputs {found}")
+        return boxes[0]['index'], named['classes']['index'], named['scores']['index']
+    
+    def detect_leaves(self, frame: np.ndarray,
+                      scale: Tuple[float, float] = (1.0, 1.0)) -> List[Tuple[int, int, int, int, float]]:
+        """Detect leaves with the INT8 model; falls back to contour detection like the FP32 path"""
+        if not self.is_initialized or self.interpreter is None:
+            return self._fallback_leaf_detection(frame, scale)
+        
+        try:
+            import cv2
+            import numpy as np
+            
+            # Resize straight into the preallocated input and convert BGR -> RGB in place
+            _, h, w, _ = self._input.shape
+            cv2.resize(frame, (w, h), dst=self._input[0])
+            cv2.cvtColor(self._input[0], cv2.COLOR_BGR2RGB, dst=self._input[0])
+            
+            self.interpreter.set_tensor(self._input_index, self._input)
+            self.interpreter.invoke()
+            
+            boxes_idx, classes_idx, scores_idx = self._output_indices
+            boxes = self.interpreter.get_tensor(boxes_idx)[0]  # (ymin, xmin, ymax, xmax), normalized
+            classes = self.interpreter.get_tensor(classes_idx)[0]
+            scores = self.interpreter.get_tensor(scores_idx)[0]
+            
+            keep = (scores > self.confidence_threshold) & (classes.astype(np.int32) == self.LEAF_CLASS_ID)
+            return self._to_leaves(boxes[keep][:, [1, 0, 3, 2]], scores[keep], frame.shape, scale)
+            
+        except Exception as e:
+            print(f"Error in TFLite leaf detection: {e}")
+            return self._fallback_leaf_detection(frame, scale)
+
+
 class AutomaticLeafDetectionService:
     """Service for automatic leaf detection and disease classification"""
     
+    RESIZE_POOL_SIZE = 16
+    
     def __init__(self):
+        import numpy as np
+        
         self.detector = MobileNetSSDLeafDetector()
         self.is_running = False
-        self.detection_interval = 2.0  # Detect every 2 seconds
-        self.last_detection_time = 0
         self.current_detections = []
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='leaf-classify')
+        # Reusable 224x224 leaf buffers; each is encoded before it can be handed out again
+        self._resize_pool = [np.empty((224, 224, 3), np.uint8) for _ in range(self.RESIZE_POOL_SIZE)]
         
     def initialize(self):
         """Initialize the detection model"""
+        # INT8 TFLite detector when configured, FP32 MobileNet-SSD otherwise (or if it fails to load)
+        config = current_app.config if has_app_context() else {}
+        if config.get("LEAF_DETECTOR_MODEL") == "tflite_int8":
+            detector = TFLiteSSDLeafDetector()
+            if detector.initialize_model(config.get("LEAF_DETECTOR_TFLITE_PATH")):
+                self.detector = detector
+                return True
+            print("Falling back to FP32 MobileNet-SSD")
+        
         # Try to initialize MobileNet-SSD
         model_initialized = self.detector.initialize_model()
         
@@ -182,70 +377,72 @@ class AutomaticLeafDetectionService:
         
         return True
     
-    def detect_leaves_in_frame(self, frame: np.ndarray) -> List[Tuple[int, int, int, int, float]]:
-        """Detect leaves in the current frame"""
-        return self.detector.detect_leaves(frame)
+    def detect_leaves_in_frame(self, frame: np.ndarray,
+                               scale: Tuple[float, float] = (1.0, 1.0)) -> List[Tuple[int, int, int, int, float]]:
+        """Detect leaves in the given frame, which may already be downscaled by scale"""
+        return self.detector.detect_leaves(frame, scale)
     
     def process_detections(self, frame: np.ndarray, detections: List[Tuple[int, int, int, int, float]]) -> List[dict]:
         """Process detected leaves and classify diseases"""
-        results = []
+        from .jpeg import encode_jpeg
+        
+        # Workers classify in-process and need the caller's app (config, database)
+        app = current_app._get_current_object()
+        
+        # One slot per leaf: either a pending classification or an error dict, kept in detection order
+        pending = []
         
         for i, (x1, y1, x2, y2, confidence) in enumerate(detections):
+            leaf_info = {
+                'bbox': (x1, y1, x2, y2),
+                'confidence': confidence,
+                'leaf_index': i
+            }
             try:
                 # Crop leaf region
                 leaf_crop = self.detector.crop_leaf(frame, (x1, y1, x2, y2))
                 
-                # Resize for API compatibility
-                leaf_resized = self.detector.resize_leaf(leaf_crop)
+                # Resize for API compatibility into a pooled buffer
+                leaf_resized = self.detector.resize_leaf(
+                    leaf_crop, dst=self._resize_pool[i % self.RESIZE_POOL_SIZE]
+                )
                 
-                # Save temporarily for API call
-                temp_path = f"temp_leaf_{int(time.time())}_{i}.jpg"
-                cv2.imwrite(temp_path, leaf_resized)
+                # Encode now, before the pooled buffer can be reused
+                image_bytes = encode_jpeg(leaf_resized, quality=85)
+                if image_bytes is None:
+                    raise ValueError("JPEG encoding failed")
                 
-                try:
-                    # Send to disease detection API
-                    with open(temp_path, 'rb') as f:
-                        files = {'image': f}
-                        response = requests.post('http://localhost:5000/api/upload_detect', files=files)
-                        
-                        if response.status_code == 200:
-                            result = response.json()
-                            result.update({
-                                'bbox': (x1, y1, x2, y2),
-                                'confidence': confidence,
-                                'leaf_index': i
-                            })
-                            results.append(result)
-                        else:
-                            results.append({
-                                'error': f"API request failed: {response.status_code}",
-                                'bbox': (x1, y1, x2, y2),
-                                'confidence': confidence,
-                                'leaf_index': i
-                            })
-                finally:
-                    # Clean up temp file
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
+                # Classify concurrently; detection backends are independent and mostly I/O-bound
+                pending.append(self._pool.submit(self._classify_leaf, app, image_bytes, leaf_info))
                         
             except Exception as e:
-                results.append({
-                    'error': f"Processing failed: {str(e)}",
-                    'bbox': (x1, y1, x2, y2),
-                    'confidence': confidence,
-                    'leaf_index': i
-                })
-        
-        return results
-    
-    def should_detect(self) -> bool:
-        """Check if it's time to run detection"""
-        current_time = time.time()
-        if current_time - self.last_detection_time >= self.detection_interval:
-            self.last_detection_time = current_time
-            return True
-        return False
+                leaf_info['error'] = f"Processing failed: {str(e)}"
+                pending.append(leaf_info)
+        
+        return [p.result() if isinstance(p, Future) else p for p in pending]
+    
+    def _classify_leaf(self, app, image_bytes, leaf_info: dict) -> dict:
+        """Classify one encoded leaf through the shared upload pipeline"""
+        from .pipeline import process_jpeg
+        
+        try:
+            with app.app_context():
+                result = process_jpeg(image_bytes)
+            result.update(leaf_info)
+            return result
+        except Exception as e:
+            return dict(leaf_info, error=f"Processing failed: {str(e)}")
+
+
+_leaf_service_lock = threading.Lock()
+
+
+@cache
+def _create_leaf_service() -> AutomaticLeafDetectionService:
+    return AutomaticLeafDetectionService()
 
 
-# Global instance
-leaf_detection_service = AutomaticLeafDetectionService() 
\ No newline at end of file
+def get_leaf_service() -> AutomaticLeafDetectionService:
+    """Lazily created shared AutomaticLeafDetectionService; locked so it is only ever built once"""
+    with _leaf_service_lock:
+        return _create_leaf_service() 
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+Leaf classification pipeline shared by the upload route, manual region analysis
+and automatic detection: detect, log the cycle, and build the JSON-ready result.
+None of these entry points actuate the sprayer.
+"""
+import os
+import uuid
+from typing import Dict
+from .db import record_cycle_async
+from .detection import detect_disease, detect_disease_from_array, detect_disease_from_jpeg
+
+
+def new_image_path(ext: str = ".jpg") -> str:
+    """Fresh upload_<uuid> path inside IMAGE_DIR"""
+    # Imported here to avoid a circular import; the routes blueprint holds the config snapshot
+    from .routes import _CFG
+    image_dir = _CFG["IMAGE_DIR"]
+    os.makedirs(image_dir, exist_ok=True)
+    return os.path.join(image_dir, f"upload_{uuid.uuid4().hex}{ext}")
+
+
+def process_upload(save_path: str) -> Dict:
+    """Classify an image already saved under IMAGE_DIR"""
+    disease, severity, raw = detect_disease(save_path)
+    return _finish(save_path, disease, severity, raw)
+
+
+def process_array(leaf_crop) -> Dict:
+    """Classify a BGR leaf crop; its JPEG is saved under IMAGE_DIR as the logged capture"""
+    save_path = new_image_path()
+    disease, severity, raw = detect_disease_from_array(leaf_crop, save_path=save_path)
+    return _finish(save_path, disease, severity, raw)
+
+
+def process_jpeg(image_bytes) -> Dict:
+    """Classify an encoded leaf JPEG; the bytes are saved under IMAGE_DIR as the logged capture"""
+    save_path = new_image_path()
+    disease, severity, raw = detect_disease_from_jpeg(image_bytes, save_path=save_path)
+    return _finish(save_path, disease, severity, raw)
+
+
+def _finish(save_path: str, disease: str, severity: float, raw: Dict) -> Dict:
+    from .routes import _CFG
+
+    # Uploads and manual analysis never actuate GPIO
+    action = "none"
+    duration_ms = 0
+
+    # Logged by the background writer so the response doesn't wait on SQLite
+    record_cycle_async(save_path, disease, severity, raw, action, duration_ms)
+
+    is_healthy = (severity or 0) <= _CFG["SEVERITY_LOW_THRESHOLD"] and (disease or "").lower() == "healthy"
+    return {
+        "image_url": f"/images/{os.path.basename(save_path)}",
+        "disease": disease,
+        "severity": severity,
+        "class": "healthy" if is_healthy else "infected",
+        "action": action,
+        "duration_ms": duration_ms,
+    }
@@ -1,17 +1,49 @@
-from flask import Blueprint, current_app, jsonify, render_template, request, send_from_directory, Response
+from flask import Blueprint, jsonify, render_template, request, send_from_directory, Response
 from .camera import get_camera
 from .detection import detect_disease
 from .gpio_control import get_sprayer
-from .db import insert_capture, insert_detection, insert_action, get_recent
+from .db import record_cycle_async, get_recent
+from .pipeline import new_image_path, process_upload
 from .video_detection import video_service
-import json
+from .jpeg import MJPEG_PART_HEADER
 import os
-import uuid
-import cv2
 import time
 
+try:
+    import orjson  # type: ignore
+except ImportError:  # optional; Flask's jsonify is the fallback
+    orjson = None
+
 bp = Blueprint("routes", __name__)
 
+# Config values read on hot paths, resolved once when the blueprint is registered
+_CFG_KEYS = (
+    "SEVERITY_LOW_THRESHOLD",
+    "SEVERITY_HIGH_THRESHOLD",
+    "SPRAY_DURATION_LOW_MS",
+    "SPRAY_DURATION_HIGH_MS",
+    "IMAGE_DIR",
+    "VIDEO_HLS_DIR",
+)
+_CFG = {}
+
+
+@bp.record
+def _capture_cfg(setup_state) -> None:
+    _CFG.update({k: setup_state.app.config[k] for k in _CFG_KEYS})
+
+
+def ojsonify(obj, status: int = 200) -> Response:
+    """JSON response encoded with orjson (numpy values included) when installed, jsonify otherwise"""
+    if orjson is not None:
+        try:
+            return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), status=status, mimetype="application/json")
+        except TypeError:
+            pass
+    response = jsonify(obj)
+    response.status_code = status
+    return response
+
 
 @bp.route("/")
 def index():
@@ -21,35 +53,41 @@ def index():
         captures=captures,
         detections=detections,
         actions=actions,
-        low=current_app.config["SEVERITY_LOW_THRESHOLD"],
-        high=current_app.config["SEVERITY_HIGH_THRESHOLD"],
+        low=_CFG["SEVERITY_LOW_THRESHOLD"],
+        high=_CFG["SEVERITY_HIGH_THRESHOLD"],
     )
 
 
 @bp.route('/images/<path:filename>')
 def serve_image(filename: str):
-    image_dir = current_app.config["IMAGE_DIR"]
-    return send_from_directory(image_dir, filename)
+    return send_from_directory(_CFG["IMAGE_DIR"], filename)
 
 
 @bp.route("/video_feed")
 def video_feed():
     """Video streaming route"""
     def generate():
+        seq = 0
         while True:
-            frame = video_service.get_frame()
-            if frame is not None:
-                # Encode frame to JPEG
-                ret, buffer = cv2.imencode('.jpg', frame)
-                if ret:
-                    frame_bytes = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(0.1)  # 10 FPS
+            if not video_service.is_running:
+                time.sleep(0.1)
+                continue
+            # Wake once per frame; the capture thread has already encoded it for all clients
+            new_seq, frame_bytes = video_service.wait_for_jpeg(seq, timeout=1.0)
+            if frame_bytes is None or new_seq == seq:
+                continue
+            seq = new_seq
+            yield MJPEG_PART_HEADER + frame_bytes + b'\r\n'
     
     return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
+@bp.route("/video_hls/<path:filename>")
+def video_hls(filename: str):
+    """Hardware-encoded H.264 HLS playlist and segments (VIDEO_SOURCE=picamera2 with VIDEO_HLS_ENABLED)"""
+    return send_from_directory(_CFG["VIDEO_HLS_DIR"], filename)
+
+
 @bp.route("/api/start_video", methods=["POST"])
 def start_video():
     """Start video capture"""
@@ -93,29 +131,29 @@ def video_click():
     """Handle click on video to create leaf region (manual mode only)"""
     try:
         if video_service.automatic_mode:
-            return jsonify({"error": "Manual selection disabled in automatic mode"}), 400
+            return ojsonify({"error": "Manual selection disabled in automatic mode"}, 400)
             
         data = request.json
         x = data.get('x')
         y = data.get('y')
         
         if x is None or y is None:
-            return jsonify({"error": "Missing x or y coordinates"}), 400
+            return ojsonify({"error": "Missing x or y coordinates"}, 400)
         
         # Add click region to video service
         region = video_service.add_click_region(x, y)
         if region:
-            return jsonify({
+            return ojsonify({
                 "status": "success", 
                 "message": "Region created",
                 "region": region,
                 "region_count": len(video_service.selected_regions)
             })
         else:
-            return jsonify({"error": "Failed to create region (try again in 1 second)"}), 400
+            return ojsonify({"error": "Failed to create region (try again in 1 second)"}, 400)
             
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}, 500)
 
 
 @bp.route("/api/detect_leaf", methods=["POST"])
@@ -123,15 +161,15 @@ def detect_leaf():
     """Detect disease in a specific leaf region (manual mode only)"""
     try:
         if video_service.automatic_mode:
-            return jsonify({"error": "Manual detection disabled in automatic mode"}), 400
+            return ojsonify({"error": "Manual detection disabled in automatic mode"}, 400)
             
         data = request.json
         region_index = data.get('region_index', 0)
         
         result = video_service.detect_and_classify_leaf(region_index)
-        return jsonify(result)
+        return ojsonify(result)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}, 500)
 
 
 @bp.route("/api/get_automatic_detections", methods=["GET"])
@@ -139,38 +177,38 @@ def get_automatic_detections():
     """Get results from automatic leaf detection"""
     try:
         if not video_service.automatic_mode:
-            return jsonify({"error": "Automatic mode not enabled"}), 400
+            return ojsonify({"error": "Automatic mode not enabled"}, 400)
             
         detections = video_service.get_automatic_detections()
-        return jsonify({
+        return ojsonify({
             "status": "success",
             "detections": detections,
             "count": len(detections)
         })
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}, 500)
 
 
 @bp.route("/api/capture_detect", methods=["POST"]) 
 def capture_detect():
     camera = get_camera()
     image_path = camera.capture_image()
-    capture_id = insert_capture(image_path)
 
     disease, severity, raw = detect_disease(image_path)
-    detection_id = insert_detection(capture_id, disease, severity, json.dumps(raw))
 
     action, duration_ms = decide_action(severity)
     if duration_ms > 0:
         sprayer = get_sprayer()
-        sprayer.spray_for_ms(duration_ms)
-    insert_action(detection_id, action, duration_ms)
+        sprayer.spray_async(duration_ms)
+
+    # Logged by the background writer so the response doesn't wait on SQLite
+    record_cycle_async(image_path, disease, severity, raw, action, duration_ms)
 
     # Expose image URL from filename
     filename = os.path.basename(image_path)
     image_url = f"/images/{filename}"
 
-    return jsonify(
+    return ojsonify(
         {
             "image_path": image_path,
             "image_url": image_url,
@@ -185,47 +223,22 @@ def capture_detect():
 @bp.route("/api/upload_detect", methods=["POST"]) 
 def upload_detect():
     if "image" not in request.files:
-        return jsonify({"error": "No image file provided"}), 400
+        return ojsonify({"error": "No image file provided"}, 400)
     file = request.files["image"]
     if file.filename == "":
-        return jsonify({"error": "Empty filename"}), 400
+        return ojsonify({"error": "Empty filename"}, 400)
     # Save upload
     ext = os.path.splitext(file.filename)[1].lower() or ".jpg"
-    filename = f"upload_{uuid.uuid4().hex}{ext}"
-    image_dir = current_app.config["IMAGE_DIR"]
-    os.makedirs(image_dir, exist_ok=True)
-    save_path = os.path.join(image_dir, filename)
+    save_path = new_image_path(ext)
     file.save(save_path)
 
-    # Log capture
-    capture_id = insert_capture(save_path)
-
-    # Detect
-    disease, severity, raw = detect_disease(save_path)
-    detection_id = insert_detection(capture_id, disease, severity, json.dumps(raw))
-
-    # Do NOT actuate GPIO in PC upload flow
-    action = "none"
-    duration_ms = 0
-    insert_action(detection_id, action, duration_ms)
-
-    return jsonify(
-        {
-            "image_url": f"/images/{filename}",
-            "disease": disease,
-            "severity": severity,
-            "class": "healthy" if (severity or 0) <= current_app.config["SEVERITY_LOW_THRESHOLD"] and (disease or "").lower() == "healthy" else "infected",
-            "action": action,
-            "duration_ms": duration_ms,
-        }
-    )
+    # Detect, log and build the response in-process (shared with manual region analysis)
+    return ojsonify(process_upload(save_path))
 
 
 def decide_action(severity: float):
-    low = current_app.config["SEVERITY_LOW_THRESHOLD"]
-    high = current_app.config["SEVERITY_HIGH_THRESHOLD"]
-    if severity < low:
+    if severity < _CFG["SEVERITY_LOW_THRESHOLD"]:
         return "none", 0
-    if severity < high:
-        return "spray_short", int(current_app.config["SPRAY_DURATION_LOW_MS"])
-    return "spray_long", int(current_app.config["SPRAY_DURATION_HIGH_MS"]) 
\ No newline at end of file
+    if severity < _CFG["SEVERITY_HIGH_THRESHOLD"]:
+        return "spray_short", int(_CFG["SPRAY_DURATION_LOW_MS"])
+    return "spray_long", int(_CFG["SPRAY_DURATION_HIGH_MS"])
@@ -1,12 +1,18 @@
-import cv2
-import numpy as np
+from __future__ import annotations
+
+import io
+import threading
 import time
-from typing import List, Tuple, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, List, Tuple, Optional, Union
 import os
-from flask import current_app
-import requests
-import json
-from .leaf_detector import leaf_detection_service
+from flask import current_app, has_app_context
+from .leaf_detector import get_leaf_service
+
+# cv2 is imported where it is used to keep OpenCV off the app import path
+if TYPE_CHECKING:
+    import numpy as np
 
 
 class LightweightLeafSelector:
@@ -14,32 +20,35 @@ class LightweightLeafSelector:
     
     def __init__(self):
         self.region_size = 150  # Fixed region size for consistency
-        self.last_click_time = 0
+        self._next_click_allowed = 0.0  # time.monotonic() deadline set by the last accepted click
         self.click_cooldown = 1.0  # Prevent rapid clicks
         
     def create_region_from_click(self, frame: np.ndarray, click_x: int, click_y: int) -> Optional[Tuple[int, int, int, int]]:
         """Create a bounding box region around the clicked point"""
-        current_time = time.time()
+        now = time.monotonic()
         
         # Prevent rapid clicking
-        if current_time - self.last_click_time < self.click_cooldown:
+        if now < self._next_click_allowed:
             return None
         
-        self.last_click_time = current_time
+        self._next_click_allowed = now + self.click_cooldown
+        
+        import numpy as np
         
         frame_height, frame_width = frame.shape[:2]
         half_size = self.region_size // 2
         
-        # Calculate region bounds
-        x1 = max(0, click_x - half_size)
-        y1 = max(0, click_y - half_size)
-        x2 = min(frame_width, click_x + half_size)
-        y2 = min(frame_height, click_y + half_size)
+        # Calculate region bounds, clamped to the frame in one call
+        bounds = np.clip(
+            np.array([click_x, click_y, click_x, click_y]) + (-half_size, -half_size, half_size, half_size),
+            0, (frame_width, frame_height, frame_width, frame_height)
+        )
         
         # Ensure minimum size
-        if (x2 - x1) < 100 or (y2 - y1) < 100:
+        if ((bounds[2:] - bounds[:2]) < 100).any():
             return None
             
+        x1, y1, x2, y2 = bounds.tolist()
         return (x1, y1, x2, y2)
     
     def crop_leaf(self, frame: np.ndarray, bbox: Tuple[int, int, int, int]) -> np.ndarray:
@@ -48,49 +57,262 @@ class LightweightLeafSelector:
         return frame[y1:y2, x1:x2]
 
 
+class _HardwareJpegOutput(io.BufferedIOBase):
+    """picamera2 FileOutput target holding the newest frame from the hardware MJPEGEncoder"""
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame: Optional[bytes] = None
+        self._seq = 0
+    
+    def write(self, buf) -> int:
+        # Each write from MJPEGEncoder is one complete JPEG
+        with self._cond:
+            self._frame = buf
+            self._seq += 1
+            self._cond.notify_all()
+        return len(buf)
+    
+    def wait_for_frame(self, last_seq: int, timeout: float = 1.0) -> Tuple[int, Optional[bytes]]:
+        """Block until a frame newer than last_seq arrives; returns (seq, None) on timeout"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq != last_seq, timeout):
+                return last_seq, None
+            return self._seq, self._frame
+
+
 class VideoCaptureService:
+    AUTO_DETECTION_SIZE = (320, 240)  # Frame size fed to the automatic leaf detector
+    SCENE_HASH_THRESHOLD = 5  # dHash bits that must differ before detection runs again
+    REGION_COLOR = (0, 255, 0)  # BGR outline/label colour for manually selected regions
+    
     def __init__(self):
         self.cap = None
+        self.picam = None  # Picamera2 instance when VIDEO_SOURCE=picamera2
+        self._picam_recording = False  # True while any picamera2 encoder (H.264 HLS, MJPEG) is running
+        self._mjpeg_out: Optional[_HardwareJpegOutput] = None  # newest hardware-encoded JPEG
+        self._v4l2_mjpeg = False  # True when cap.read() returns the webcam's undecoded MJPEG
         self.selector = LightweightLeafSelector()
         self.is_running = False
-        self.current_frame = None
+        self._last_frame = None  # Latest camera frame; overlays are drawn onto it in place, so only its size is used
+        self._region_crops = []  # Unannotated copies of each selected region, refreshed by every get_frame
         self.selected_regions = []  # Store user-selected regions
         self.automatic_mode = False  # Toggle between manual and automatic detection
-        self.last_auto_detection_time = 0
+        self._next_auto_deadline = 0.0  # time.monotonic() at which automatic detection is next due
         self.auto_detection_interval = 3.0  # Run automatic detection every 3 seconds
+        # dHash of the last frame that went through detection, and the boxes it produced
+        self._last_hash: Optional[int] = None
+        self._last_detections = []
+        # Severity thresholds and spray durations, refreshed from config in start_camera
+        self._low, self._high = 30.0, 70.0
+        self._dur_lo, self._dur_hi = 1000, 3000
+        # Latest annotated frame, JPEG-encoded once by the capture thread for all stream clients
+        self._capture_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._frame_cond = threading.Condition()
+        self._frame_seq = 0
+        self._latest_jpeg: Optional[Union[bytes, memoryview]] = None
+        self._label_sprites = {}  # region number -> (text mask, ascent)
+        # One-slot worker that classifies, sprays and logs auto-detected leaves off the capture thread
+        self._classify_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='leaf-log')
+        self._classify_future: Optional[Future] = None
         
     def start_camera(self, camera_index: int = 0):
         """Start video capture"""
+        if self._capture_thread is not None and self._capture_thread.is_alive():
+            if self.is_running:
+                return True
+            # The previous run's thread is still finishing (e.g. a slow classification)
+            print("Previous capture thread is still stopping; try again shortly")
+            return False
+        
         try:
-            self.cap = cv2.VideoCapture(camera_index)
-            if not self.cap.isOpened():
-                print(f"Failed to open camera {camera_index}")
-                return False
+            config = current_app.config if has_app_context() else {}
+            self.init_config(config)
             
-            # Set camera properties for Pi optimization
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-            self.cap.set(cv2.CAP_PROP_FPS, 15)  # Lower FPS for Pi performance
+            if config.get("VIDEO_SOURCE") == "picamera2" and self._start_picamera2(config):
+                print("Using PiCamera2 for video")
+            elif not self._start_opencv(camera_index):
+                return False
             
             # Initialize leaf detection service
-            leaf_detection_service.initialize()
+            get_leaf_service().initialize()
             
             self.is_running = True
+            
+            # Capture and annotate on one background thread (inside the app context, for DB logging)
+            app = current_app._get_current_object() if has_app_context() else None
+            self._stop_event = threading.Event()  # per run, so a lingering old thread can never resume
+            self._capture_thread = threading.Thread(target=self._capture_loop, args=(app, self._stop_event), daemon=True)
+            self._capture_thread.start()
             print("Camera started successfully")
             return True
         except Exception as e:
             print(f"Error starting camera: {e}")
             return False
     
+    def init_config(self, config):
+        """Snapshot action thresholds so per-detection decisions never touch the app context"""
+        self._low = float(config.get("SEVERITY_LOW_THRESHOLD", self._low))
+        self._high = float(config.get("SEVERITY_HIGH_THRESHOLD", self._high))
+        self._dur_lo = int(config.get("SPRAY_DURATION_LOW_MS", self._dur_lo))
+        self._dur_hi = int(config.get("SPRAY_DURATION_HIGH_MS", self._dur_hi))
+    
     def stop_camera(self):
         """Stop video capture"""
         self.is_running = False
+        self._stop_event.set()
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        if self._capture_thread is not None:
+            self._capture_thread.join(timeout=2.0)
+            # A thread still inside a camera read stays referenced so start_camera waits for it
+            if not self._capture_thread.is_alive():
+                self._capture_thread = None
+        with self._frame_cond:
+            self._latest_jpeg = None
+        # A capture thread releases the devices itself on exit; never pull them out from under it
+        if self._capture_thread is None:
+            self._release_devices()
+        self.selected_regions.clear()
+        self._last_frame = None
+        self._region_crops = []
+        self._last_hash, self._last_detections = None, []
+        # Sprays queued by automatic detection are stale once the camera stops
+        from .gpio_control import cancel_pending_sprays
+        cancel_pending_sprays()
+        print("Camera stopped and resources released")
+    
+    def _release_devices(self):
+        """Close the camera handles; only called once no capture thread can touch them"""
         if self.cap:
             self.cap.release()
             self.cap = None
-        self.selected_regions.clear()
-        self.current_frame = None
-        print("Camera stopped and resources released")
+        self._v4l2_mjpeg = False
+        self._mjpeg_out = None
+        if self.picam is not None:
+            if self._picam_recording:
+                self.picam.stop_recording()
+                self._picam_recording = False
+            else:
+                self.picam.stop()
+            self.picam.close()
+            self.picam = None
+    
+    def _start_picamera2(self, config) -> bool:
+        """
+        Start the Pi camera: 640x480 BGR frames for annotation/detection and, when
+        VIDEO_HLS_ENABLED is set, a hardware H.264 encode of the same stream segmented
+        into HLS under VIDEO_HLS_DIR (served at /video_hls/stream.m3u8).
+        """
+        try:
+            from picamera2 import Picamera2  # type: ignore
+            
+            self.picam = Picamera2()
+            # RGB888 gives BGR-ordered arrays, matching OpenCV
+            self.picam.configure(self.picam.create_video_configuration(
+                main={"size": (640, 480), "format": "RGB888"},
+                controls={"FrameRate": 15}
+            ))
+            
+            hls_dir = config.get("VIDEO_HLS_DIR")
+            if config.get("VIDEO_HLS_ENABLED") and hls_dir:
+                from picamera2.encoders import H264Encoder  # type: ignore
+                from picamera2.outputs import FfmpegOutput  # type: ignore
+                
+                os.makedirs(hls_dir, exist_ok=True)
+                playlist = os.path.join(hls_dir, "stream.m3u8")
+                output = FfmpegOutput(f"-f hls -hls_time 1 -hls_list_size 5 -hls_flags delete_segments {playlist}")
+                self.picam.start_recording(H264Encoder(bitrate=2_000_000), output)
+                self._picam_recording = True
+                print(f"H.264 HLS stream at {playlist}")
+            else:
+                self.picam.start()
+            self._start_hardware_mjpeg()
+            return True
+        except Exception as e:
+            print(f"PiCamera2 unavailable, falling back to OpenCV: {e}")
+            if self.picam is not None:
+                self.picam.close()
+                self.picam = None
+            return False
+    
+    def _start_opencv(self, camera_index: int) -> bool:
+        """
+        Open a webcam, preferring V4L2 with MJPG frames and a one-frame driver queue.
+        When the driver hands back the undecoded JPEG, frames without overlays are streamed as-is.
+        """
+        import cv2
+        
+        self.cap = cv2.VideoCapture(camera_index, cv2.CAP_V4L2)
+        if not self.cap.isOpened():
+            self.cap = cv2.VideoCapture(camera_index)  # non-Linux or no V4L2 device
+        if not self.cap.isOpened():
+            print(f"Failed to open camera {camera_index}")
+            return False
+        
+        # Set camera properties for Pi optimization
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        self.cap.set(cv2.CAP_PROP_FPS, 15)  # Lower FPS for Pi performance
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Always read the newest frame
+        
+        # Ask for raw MJPEG; keep it only if the probe frame really is a JPEG
+        self._v4l2_mjpeg = False
+        if self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            ret, probe = self.cap.read()
+            self._v4l2_mjpeg = bool(
+                ret and probe is not None and probe.ndim <= 2 and probe.size > 2
+                and probe.flat[0] == 0xFF and probe.flat[1] == 0xD8
+            )
+            if not self._v4l2_mjpeg:
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        if self._v4l2_mjpeg:
+            print("Streaming the webcam's MJPEG frames when no overlay is drawn")
+        return True
+    
+    def get_frame_jpeg(self) -> Optional[memoryview]:
+        """Next webcam frame as the camera's own MJPEG bytes (no decode or re-encode), or None"""
+        if not self._v4l2_mjpeg or self.cap is None:
+            return None
+        ret, buf = self.cap.read()
+        return buf.reshape(-1).data if ret and buf is not None else None
+    
+    def _start_hardware_mjpeg(self):
+        """Run the Pi's hardware JPEG encoder on the main stream so idle frames need no CPU encode"""
+        try:
+            from picamera2.encoders import MJPEGEncoder  # type: ignore
+            from picamera2.outputs import FileOutput  # type: ignore
+            
+            output = _HardwareJpegOutput()
+            self.picam.start_encoder(MJPEGEncoder(), FileOutput(output), name="main")
+            self._picam_recording = True
+            self._mjpeg_out = output
+            print("Streaming hardware MJPEG frames when no overlay is drawn")
+        except Exception as e:
+            print(f"Hardware MJPEG unavailable, encoding frames on the CPU: {e}")
+            self._mjpeg_out = None
+    
+    def _can_pass_through(self) -> bool:
+        """True when the next frame needs no overlay and no detection, so the camera-encoded JPEG can be sent as-is"""
+        if self.automatic_mode:
+            return (not get_leaf_service().current_detections
+                    and time.monotonic() < self._next_auto_deadline)
+        # Manual mode: nothing selected yet, and a frame is on hand for sizing click regions
+        return not self.selected_regions and self._last_frame is not None
+    
+    def _read_raw_frame(self) -> Optional[np.ndarray]:
+        """Read the next unannotated BGR frame from the active source"""
+        if self.picam is not None:
+            return self.picam.capture_array("main")
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        if self._v4l2_mjpeg:
+            import cv2
+            frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
+        return frame
     
     def toggle_automatic_mode(self):
         """Toggle between manual and automatic detection modes"""
@@ -103,147 +325,276 @@ class VideoCaptureService:
     
     def get_frame(self) -> Optional[np.ndarray]:
         """Get current frame with selected regions or automatic detections highlighted"""
-        if not self.is_running or not self.cap:
+        if not self.is_running or (not self.cap and self.picam is None):
             return None
         
-        ret, frame = self.cap.read()
-        if not ret:
+        frame = self._read_raw_frame()
+        if frame is None:
             return None
+        self._last_frame = frame
         
         # Run automatic detection if enabled and it's time
         if self.automatic_mode and self._should_run_auto_detection():
             self._run_automatic_detection(frame)
         
-        # Draw detections on frame
-        annotated_frame = frame.copy()
+        # Draw detections directly on the frame; cap.read() hands us a fresh buffer
+        annotated_frame = frame
         
         if self.automatic_mode:
             # Draw automatic detections
-            annotated_frame = leaf_detection_service.detector.draw_detections(
+            annotated_frame = get_leaf_service().detector.draw_detections(
                 annotated_frame, 
-                leaf_detection_service.current_detections
+                get_leaf_service().current_detections,
+                inplace=True
             )
         else:
-            # Draw manual selections
+            # Overlays are drawn in place, so keep clean copies of just the selected regions for classification;
+            # the capture loop notifies _frame_cond once this frame is published
+            self._region_crops = [self.selector.crop_leaf(frame, bbox).copy() for bbox in self.selected_regions]
+            
+            # Draw manual selections with slice writes; labels are pre-rendered sprites
             for i, bbox in enumerate(self.selected_regions):
                 x1, y1, x2, y2 = bbox
-                # Draw rectangle around selected region
-                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(annotated_frame, f'Region {i+1}', 
-                           (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+                self._draw_box(annotated_frame, x1, y1, x2, y2)
+                self._blit_label(annotated_frame, self._label_sprite(i + 1), x1, y1 - 10)
         
-        self.current_frame = annotated_frame
         return annotated_frame
     
+    @staticmethod
+    def _draw_box(frame: np.ndarray, x1: int, y1: int, x2: int, y2: int,
+                  color=REGION_COLOR, thickness: int = 2):
+        """Draw a rectangle outline as four edge slice writes (no OpenCV call)"""
+        x1, y1 = max(x1, 0), max(y1, 0)
+        frame[y1:y1 + thickness, x1:x2 + 1] = color
+        frame[max(y2 - thickness + 1, 0):y2 + 1, x1:x2 + 1] = color
+        frame[y1:y2 + 1, x1:x1 + thickness] = color
+        frame[y1:y2 + 1, max(x2 - thickness + 1, 0):x2 + 1] = color
+    
+    def _label_sprite(self, n: int) -> np.ndarray:
+        """Boolean text mask for 'Region n', rasterized once and reused every frame"""
+        sprite = self._label_sprites.get(n)
+        if sprite is None:
+            import cv2
+            import numpy as np
+            text = f'Region {n}'
+            (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+            canvas = np.zeros((h + baseline + 2, w + 2), np.uint8)
+            cv2.putText(canvas, text, (1, h + 1), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 255, 2)
+            # Keep the baseline offset so the sprite lands where putText would have drawn it
+            sprite = self._label_sprites[n] = (canvas > 0, h + 1)
+        return sprite
+    
+    @staticmethod
+    def _blit_label(frame: np.ndarray, sprite, x: int, y: int, color=REGION_COLOR):
+        """Paint a label sprite with its text baseline at (x, y), clipped to the frame"""
+        mask, ascent = sprite
+        top, left = y - ascent, x - 1
+        fh, fw = frame.shape[:2]
+        t, l = max(top, 0), max(left, 0)
+        b, r = min(top + mask.shape[0], fh), min(left + mask.shape[1], fw)
+        if b <= t or r <= l:
+            return
+        frame[t:b, l:r][mask[t - top:b - top, l - left:r - left]] = color
+    
+    def _capture_loop(self, app, stop: threading.Event):
+        """Producer thread: read, annotate and encode frames, then wake every waiting stream client"""
+        from .jpeg import encode_jpeg
+        
+        hw_seq = 0
+        with app.app_context() if app is not None else nullcontext():
+            try:
+                while not stop.is_set():
+                    try:
+                        mjpeg_out = self._mjpeg_out
+                        if (mjpeg_out is not None or self._v4l2_mjpeg) and self._can_pass_through():
+                            # Already compressed by the camera (Pi hardware encoder or the webcam's MJPEG)
+                            if mjpeg_out is not None:
+                                hw_seq, jpeg = mjpeg_out.wait_for_frame(hw_seq, timeout=1.0)
+                            else:
+                                jpeg = self.get_frame_jpeg()
+                        else:
+                            frame = self.get_frame()
+                            jpeg = encode_jpeg(frame, quality=80, fast_dct=True) if frame is not None else None
+                    except Exception as e:
+                        # Keep the only producer alive through transient camera/encoder errors
+                        print(f"Error in capture loop: {e}")
+                        jpeg = None
+                    if jpeg is None:
+                        time.sleep(0.05)
+                        continue
+                    with self._frame_cond:
+                        self._latest_jpeg = jpeg
+                        self._frame_seq += 1
+                        self._frame_cond.notify_all()
+            finally:
+                # This thread owns the devices until it exits, even if stop_camera gave up waiting on it
+                try:
+                    self._release_devices()
+                except Exception as e:
+                    print(f"Error releasing camera: {e}")
+    
+    def wait_for_jpeg(self, last_seq: int, timeout: float = 1.0) -> Tuple[int, Optional[bytes]]:
+        """
+        Block until a frame newer than last_seq has been published, the camera stops, or the timeout expires.
+        Returns (seq, jpeg_bytes); slow clients simply skip the frames they missed.
+        """
+        with self._frame_cond:
+            self._frame_cond.wait_for(lambda: self._frame_seq != last_seq or not self.is_running, timeout)
+            return self._frame_seq, self._latest_jpeg
+    
     def _should_run_auto_detection(self) -> bool:
         """Check if it's time to run automatic detection"""
-        current_time = time.time()
-        if current_time - self.last_auto_detection_time >= self.auto_detection_interval:
-            self.last_auto_detection_time = current_time
+        now = time.monotonic()
+        if now >= self._next_auto_deadline:
+            self._next_auto_deadline = now + self.auto_detection_interval
             return True
         return False
     
     def _run_automatic_detection(self, frame: np.ndarray):
         """Run automatic leaf detection on the current frame"""
         try:
-            # Detect leaves in frame
-            detections = leaf_detection_service.detect_leaves_in_frame(frame)
-            leaf_detection_service.current_detections = detections
+            import cv2
+            
+            # Detect leaves on a decimated copy; the detector works at 300x300 anyway
+            height, width = frame.shape[:2]
+            dw, dh = self.AUTO_DETECTION_SIZE
+            small = cv2.resize(frame, (dw, dh), interpolation=cv2.INTER_AREA)
+            sx, sy = width / dw, height / dh
+            
+            # Unchanged scene: keep the previous boxes and skip detection and classification
+            frame_hash = self._dhash(small)
+            if self._last_hash is not None and \
+                    bin(frame_hash ^ self._last_hash).count("1") < self.SCENE_HASH_THRESHOLD:
+                get_leaf_service().current_detections = self._last_detections
+                return
+            
+            # Size thresholds apply in full-frame pixels; scale boxes back so
+            # current_detections stay in full-frame coordinates
+            detections = [
+                (int(x1 * sx), int(y1 * sy), int(x2 * sx), int(y2 * sy), confidence)
+                for x1, y1, x2, y2, confidence
+                in get_leaf_service().detect_leaves_in_frame(small, (dw / width, dh / height))
+            ]
+            get_leaf_service().current_detections = detections
             
             # Process detections if any found
             if detections:
                 print(f"Detected {len(detections)} leaves automatically")
-                # Process detections asynchronously to avoid blocking video feed
-                self._process_detections_async(frame, detections)
+                # Classify on the worker so the video feed keeps flowing; while the previous pass
+                # is still busy this one is skipped, and the scene hash is not recorded so it is retried
+                if not self._process_detections_async(frame, detections):
+                    return
+            self._last_hash, self._last_detections = frame_hash, detections
                 
         except Exception as e:
             print(f"Error in automatic detection: {e}")
     
-    def _process_detections_async(self, frame: np.ndarray, detections: List[Tuple[int, int, int, int, float]]):
-        """Process detections asynchronously to avoid blocking video feed"""
-        try:
-            # Process detections and get results
-            results = leaf_detection_service.process_detections(frame, detections)
-            
-            # Log results to database
-            for result in results:
-                if 'error' not in result:
-                    self._log_detection_result(result)
-                    
-        except Exception as e:
-            print(f"Error processing detections: {e}")
+    @staticmethod
+    def _dhash(frame: np.ndarray) -> int:
+        """64-bit difference hash: 9x8 grayscale thumbnail, one bit per left/right brightness step"""
+        import cv2
+        import numpy as np
+        
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = np.packbits(thumb[:, 1:] > thumb[:, :-1])
+        return int.from_bytes(bits.tobytes(), "big")
+    
+    def _process_detections_async(self, frame: np.ndarray, detections: List[Tuple[int, int, int, int, float]]) -> bool:
+        """Hand detections to the classification worker; returns False if it is still busy with the last pass"""
+        if self._classify_future is not None and not self._classify_future.done():
+            return False
+        app = current_app._get_current_object() if has_app_context() else None
+        # get_frame draws the boxes onto frame in place next, so the worker gets its own copy
+        self._classify_future = self._classify_pool.submit(
+            self._process_detections, app, self._stop_event, frame.copy(), detections
+        )
+        return True
     
-    def _log_detection_result(self, result: dict):
-        """Log detection result to database"""
+    def _process_detections(self, app, stop: threading.Event, frame: np.ndarray,
+                            detections: List[Tuple[int, int, int, int, float]]):
+        """Classify detected leaves, then spray and log each result (runs on the classification worker)"""
+        with app.app_context() if app is not None else nullcontext():
+            try:
+                # Process detections and get results
+                results = get_leaf_service().process_detections(frame, detections)
+                
+                # Queue the frame's results as one job, so the background writer commits them together
+                cycles = [self._log_detection_result(frame, result, stop) for result in results if 'error' not in result]
+                from .db import record_cycles_async
+                record_cycles_async([cycle for cycle in cycles if cycle is not None])
+                
+            except Exception as e:
+                print(f"Error processing detections: {e}")
+    
+    def _log_detection_result(self, frame: np.ndarray, result: dict, stop: threading.Event) -> Optional[tuple]:
+        """
+        Save the leaf cropped from the unannotated frame and act on its severity.
+        Returns the cycle to log (record_cycle_async arguments), or None if there is nothing to log.
+        """
         try:
             # Import here to avoid circular imports
-            from .db import insert_capture, insert_detection, insert_action
+            from .jpeg import encode_jpeg
             
             # Save cropped leaf image
-            if self.current_frame is not None:
+            if frame is not None:
                 bbox = result.get('bbox')
                 if bbox:
                     x1, y1, x2, y2 = bbox
-                    leaf_crop = self.current_frame[y1:y2, x1:x2]
+                    leaf_crop = frame[y1:y2, x1:x2]
                     
                     # Save image
                     timestamp = int(time.time())
                     image_path = f"data/db/images/auto_leaf_{timestamp}_{result.get('leaf_index', 0)}.jpg"
                     os.makedirs(os.path.dirname(image_path), exist_ok=True)
-                    cv2.imwrite(image_path, leaf_crop)
-                    
-                    # Log to database
-                    capture_id = insert_capture(image_path)
-                    detection_id = insert_detection(
-                        capture_id, 
-                        result.get('disease', 'unknown'), 
-                        result.get('severity', 0.0), 
-                        json.dumps(result)
-                    )
+                    image_bytes = encode_jpeg(leaf_crop, quality=85)
+                    if image_bytes is None:
+                        raise ValueError("JPEG encoding failed")
+                    with open(image_path, 'wb') as f:
+                        f.write(image_bytes)
                     
                     # Decide action based on severity
                     severity = result.get('severity', 0.0)
                     action, duration_ms = self._decide_action(severity)
                     
-                    # Execute action if needed
-                    if duration_ms > 0:
+                    # Execute action if needed, unless the camera was stopped while classifying
+                    if duration_ms > 0 and not stop.is_set():
                         from .gpio_control import get_sprayer
                         sprayer = get_sprayer()
-                        sprayer.spray_for_ms(duration_ms)
+                        sprayer.spray_async(duration_ms)
                     
-                    # Log action
-                    insert_action(detection_id, action, duration_ms)
+                    # Capture, detection and action for the background writer
+                    return (
+                        image_path,
+                        result.get('disease', 'unknown'),
+                        severity,
+                        result,
+                        action,
+                        duration_ms
+                    )
                     
         except Exception as e:
             print(f"Error logging detection result: {e}")
+        return None
     
     def _decide_action(self, severity: float) -> Tuple[str, int]:
-        """Decide action based on disease severity"""
-        try:
-            low_threshold = current_app.config.get("SEVERITY_LOW_THRESHOLD", 30.0)
-            high_threshold = current_app.config.get("SEVERITY_HIGH_THRESHOLD", 70.0)
-            spray_duration_low = current_app.config.get("SPRAY_DURATION_LOW_MS", 1000)
-            spray_duration_high = current_app.config.get("SPRAY_DURATION_HIGH_MS", 3000)
-            
-            if severity < low_threshold:
-                return "none", 0
-            elif severity < high_threshold:
-                return "spray_short", spray_duration_low
-            else:
-                return "spray_long", spray_duration_high
-                
-        except Exception:
+        """Decide action based on disease severity, using the thresholds snapshotted in start_camera"""
+        if severity < self._low:
             return "none", 0
+        elif severity < self._high:
+            return "spray_short", self._dur_lo
+        else:
+            return "spray_long", self._dur_hi
     
     def add_click_region(self, click_x: int, click_y: int) -> Optional[Tuple[int, int, int, int]]:
         """Add a new region based on user click (manual mode only)"""
         if self.automatic_mode:
             return None  # Disabled in automatic mode
             
-        if self.current_frame is None:
+        if self._last_frame is None:
             return None
         
-        region = self.selector.create_region_from_click(self.current_frame, click_x, click_y)
+        region = self.selector.create_region_from_click(self._last_frame, click_x, click_y)
         if region:
             self.selected_regions.append(region)
             return region
@@ -257,36 +608,22 @@ class VideoCaptureService:
         if not self.selected_regions or region_index >= len(self.selected_regions):
             return {"error": "Invalid region index"}
         
-        if self.current_frame is None:
-            return {"error": "No frame available"}
-        
-        # Get the selected region
-        bbox = self.selected_regions[region_index]
-        
-        # Crop leaf region
-        leaf_crop = self.selector.crop_leaf(self.current_frame, bbox)
+        from .pipeline import process_array
         
-        # Save cropped image temporarily
-        temp_path = f"temp_leaf_{int(time.time())}.jpg"
-        cv2.imwrite(temp_path, leaf_crop)
+        # Use the clean copy taken before the region outlines were drawn; a region added
+        # since the last frame gets its copy from the next get_frame, so wait for that
+        with self._frame_cond:
+            self._frame_cond.wait_for(
+                lambda: region_index < len(self._region_crops) or not self.is_running, timeout=1.0)
+            region_crops = self._region_crops
+        if region_index >= len(region_crops):
+            return {"error": "No frame available"}
+        leaf_crop = region_crops[region_index]
         
         try:
-            # Send to disease detection API
-            with open(temp_path, 'rb') as f:
-                files = {'image': f}
-                response = requests.post('http://localhost:5000/api/upload_detect', files=files)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    # Clean up temp file
-                    os.remove(temp_path)
-                    return result
-                else:
-                    return {"error": f"API request failed: {response.status_code}"}
+            # Classify the crop in-process; its JPEG is kept as the logged capture image
+            return process_array(leaf_crop)
         except Exception as e:
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
             return {"error": f"Detection failed: {str(e)}"}
     
     def get_automatic_detections(self) -> List[dict]:
@@ -295,7 +632,7 @@ class VideoCaptureService:
             return []
         
         # Return processed results if available
-        return getattr(leaf_detection_service, 'last_results', [])
+        return getattr(get_leaf_service(), 'last_results', [])
 
 
 # Global instance